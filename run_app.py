@@ -9,18 +9,17 @@ sys.path.insert(0, str(src_path))
 
 # Run Streamlit
 if __name__ == "__main__":
-    import streamlit.web.cli as stcli
+    from streamlit import config
+    from streamlit.web import bootstrap
 
     # Path to the app
     app_path = src_path / "app.py"
 
-    # Run streamlit
-    sys.argv = [
-        "streamlit",
-        "run",
-        str(app_path),
-        "--server.port=8501",
-        "--server.address=localhost",
-    ]
+    # Run streamlit directly, skipping the CLI's argv parsing. The overrides
+    # go in flag_options so they survive config reloads when config.toml changes.
+    flag_options = {"server_port": 8501, "server_address": "localhost"}
 
-    sys.exit(stcli.main())
+    # Set as `streamlit run` does, so the app's .streamlit/config.toml is read
+    config._main_script_path = str(app_path.resolve())
+    bootstrap.load_config_options(flag_options)
+    bootstrap.run(str(app_path), is_hello=False, args=[], flag_options=flag_options)
@@ -1,14 +1,17 @@
 """Streamlit web application for Query Suggestion System."""
+import hashlib
 import os
+import time
+from collections import Counter, OrderedDict, deque
 import streamlit as st
-from dotenv import load_dotenv
+from env_init import init_env
 from pathlib import Path
 
-from metadata_loader import MetadataLoader
+from metadata_loader import MetadataLoader, METADATA_CACHE_FILE
 from search_engine import SearchEngine
 from sql_generator import SQLGenerator
 from display_sql import display_generated_sql
-from azure_auth import setup_azure_openai_client
+from async_runner import iterate_async
 from local_openai import setup_local_openai_client
 
 # Page configuration
@@ -20,95 +23,339 @@ st.set_page_config(
 )
 
 # Load environment variables
-load_dotenv()
+init_env()
+
+
+DATA_DIR = Path("data")
+
+# Saved search index, rebuilt whenever the data directory changes
+SEARCH_INDEX_FILE = ".search_index.pkl"
+
+# How long loaded metadata (and the index built from it) stays cached
+METADATA_TTL_SECONDS = 24 * 60 * 60
+
+# How long search results and generated SQL are reused for repeat queries
+QUERY_CACHE_TTL_SECONDS = 60 * 60
+
+# Maximum number of generated SQL results kept in memory
+SQL_CACHE_MAX_ENTRIES = 256
+
+# Maximum number of conversation messages kept per session
+MAX_HISTORY_MESSAGES = 50
+
+
+def data_signature(data_dir: Path) -> str:
+    """Hash the names and modification times of all files under data_dir."""
+    entries = sorted(
+        (str(path.relative_to(data_dir)), path.stat().st_mtime_ns)
+        for path in data_dir.rglob('*')
+        if path.is_file() and path.name not in (SEARCH_INDEX_FILE, METADATA_CACHE_FILE)
+    )
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+
+@st.cache_data(ttl=METADATA_TTL_SECONDS, show_spinner="Loading metadata...")
+def load_metadata(data_dir_str: str, signature: str):
+    """Parse all YAML/TXT metadata files (cached as plain data per data signature).
+
+    Also returns table counts per source type for the sidebar, and the
+    loader's file fingerprint, which keys the saved search index.
+    """
+    loader = MetadataLoader(data_dir_str)
+    yaml_metadata, txt_descriptions = loader.load_all_metadata()
+    counts = Counter(m.source_type for m in yaml_metadata)
+    return yaml_metadata, txt_descriptions, counts, loader.fingerprint
+
+
+@st.cache_resource(ttl=METADATA_TTL_SECONDS)
+def build_search_engine(data_dir_str: str):
+    """Build the search engine, reusing the saved index when the data is unchanged.
+
+    Returns the engine and the per-source table counts.
+    """
+    data_dir = Path(data_dir_str)
+    signature = data_signature(data_dir)
+    yaml_metadata, txt_descriptions, counts, fingerprint = load_metadata(data_dir_str, signature)
+
+    index_path = data_dir / SEARCH_INDEX_FILE
+    search_engine = SearchEngine.load(index_path, fingerprint, yaml_metadata, txt_descriptions)
+
+    if search_engine is None:
+        search_engine = SearchEngine(yaml_metadata, txt_descriptions)
+        try:
+            search_engine.save(index_path, fingerprint)
+        except OSError as e:
+            print(f"Error saving search index: {e}")
+
+    return search_engine, counts
 
 
-@st.cache_resource
 def initialize_system():
-    """Initialize the search system (cached for performance)."""
-    # Setup LLM client
+    """Return the search engine and per-source table counts."""
+    if not DATA_DIR.exists():
+        return None, None
+
+    return build_search_engine(str(DATA_DIR))
+
+
+def get_llm_client():
+    """Return the LLM client, model and mode label.
+
+    Not cached by Streamlit: each setup function keeps its own client and
+    the Azure one must be rebuilt when its bearer token expires.
+    """
     use_azure = os.getenv("USE_AZURE", "false").lower() == "true"
 
     if use_azure:
-        client = setup_azure_openai_client()
-        model = os.environ["AZURE_OPENAI_MODEL"]
-        mode = "Azure OpenAI"
-    else:
-        client = setup_local_openai_client()
-        model = os.environ["OPENAI_MODEL"]
-        mode = "OpenAI"
+        # Imported here so local mode never loads the Azure SDK
+        from azure_auth import setup_azure_openai_client
+        return setup_azure_openai_client(), os.environ["AZURE_OPENAI_MODEL"], "Azure OpenAI"
 
-    # Load metadata
-    data_dir = Path("data")
-    if not data_dir.exists():
-        return None, None, None, mode
+    return setup_local_openai_client(), os.environ["OPENAI_MODEL"], "OpenAI"
 
-    loader = MetadataLoader(str(data_dir))
-    yaml_metadata, txt_descriptions = loader.load_all_metadata()
 
-    # Initialize search engine
-    search_engine = SearchEngine(yaml_metadata, txt_descriptions)
+@st.cache_resource(max_entries=1)
+def get_sql_generator(_client, model: str, client_id: int):
+    """Build the SQL generator, rebuilt only when the LLM client changes."""
+    return SQLGenerator(_client, model)
+
+
+@st.cache_data(ttl=QUERY_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_search(query: str, source_type, max_results: int):
+    """Search once per (query, filter, limit); cached as (source_file, score, reasons) rows."""
+    search_engine, _ = build_search_engine(str(DATA_DIR))
+    results = search_engine.search(query, source_type=source_type, max_results=max_results)
+    return to_rows(results)
+
 
-    # Initialize SQL generator
-    sql_generator = SQLGenerator(client, model)
+def to_rows(results):
+    """Reduce SearchResults to (source_file, score, reasons) rows for caching and session state."""
+    return [(r.get_source_file(), r.relevance_score, r.match_reasons) for r in results]
 
-    return search_engine, sql_generator, (yaml_metadata, txt_descriptions), mode
 
+def from_rows(search_engine, rows):
+    """Rebuild SearchResults from rows produced by to_rows."""
+    return [search_engine.build_result(*row) for row in rows]
 
+
+@st.cache_resource
+def get_sql_cache():
+    """Process-wide cache of successful SQL generations: key -> (created_at, sql_result).
+
+    Kept by hand rather than with st.cache_data because a miss is streamed
+    to the page as it is generated.
+    """
+    return OrderedDict()
+
+
+def sql_cache_key(query: str, results, conversation_history):
+    """Key a generation by query, the top 3 tables it uses and history."""
+    return (
+        query,
+        tuple(r.get_source_file() for r in results[:3]),
+        tuple(tuple(msg.items()) for msg in conversation_history)
+    )
+
+
+def get_cached_sql(key):
+    """Return a cached SQL result for key, or None if missing or expired."""
+    entry = get_sql_cache().get(key)
+    if entry and time.time() - entry[0] < QUERY_CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+
+def store_cached_sql(key, sql_result):
+    """Cache a SQL result, evicting the oldest entries beyond the size limit."""
+    cache = get_sql_cache()
+    cache[key] = (time.time(), sql_result)
+    while len(cache) > SQL_CACHE_MAX_ENTRIES:
+        try:
+            cache.popitem(last=False)
+        except KeyError:
+            break
+
+
+def search_tables(search_engine, query: str, source_type, max_results: int):
+    """Run a (cached) search and rebuild the SearchResult objects."""
+    return from_rows(search_engine, cached_search(query, source_type, max_results))
+
+
+def generate_sql(sql_generator, query: str, results, conversation_history):
+    """Generate SQL for the top 3 results, streaming the response onto the page.
+
+    Repeated requests are answered from the SQL cache without an LLM call.
+    """
+    key = sql_cache_key(query, results, conversation_history)
+    sql_result = get_cached_sql(key)
+    if sql_result is not None:
+        return sql_result
+
+    # Stream into a placeholder that is cleared once the full answer is in,
+    # showing the SQL itself as soon as its part of the JSON arrives
+    placeholder = st.empty()
+    try:
+        with placeholder.container():
+            st.caption("Generating SQL query...")
+            sql_preview = st.empty()
+
+        llm_response = ""
+        for chunk in iterate_async(sql_generator.stream_sql(
+            user_query=query,
+            search_results=results,
+            conversation_history=conversation_history
+        )):
+            llm_response += chunk
+            partial_sql = sql_generator.partial_sql_query(llm_response)
+            if partial_sql:
+                sql_preview.code(partial_sql, language="sql")
+
+        sql_result = sql_generator.parse_sql_response(llm_response)
+    except Exception as e:
+        # Fall back to a regular request if streaming failed
+        print(f"Error streaming SQL: {e}")
+        sql_result = sql_generator.generate_sql(query, results, conversation_history)
+    placeholder.empty()
+
+    if sql_result['success']:
+        store_cached_sql(key, sql_result)
+
+    return sql_result
+
+
+def clear_session():
+    """Reset query, results and SQL (button callback, runs before the rerun)."""
+    st.session_state.conversation_history = deque(maxlen=MAX_HISTORY_MESSAGES)
+    st.session_state.last_query = ""
+    st.session_state.current_query = ""
+    st.session_state.query_input = ""
+    st.session_state.last_results = []
+    st.session_state.generated_sql = None
+    st.session_state.tables_context = None
+    st.session_state.expanded_results = set()
+
+
+def get_tables_context(sql_generator, results):
+    """Return the context string for the top 3 results.
+
+    Cached in session state and rebuilt only when those tables change, so
+    repeated refinements reuse it.
+    """
+    key = tuple(r.get_source_file() for r in results[:3])
+    cached = st.session_state.get('tables_context')
+    if cached and cached[0] == key:
+        return cached[1]
+
+    tables_context = sql_generator._build_tables_context(
+        results,
+        list(range(min(3, len(results))))
+    )
+    st.session_state.tables_context = (key, tables_context)
+    return tables_context
+
+
+def refine_generated_sql(sql_generator, results, refinement_request: str):
+    """Refine the SQL in session state; the caller renders the result afterwards."""
+    sql_result = st.session_state.generated_sql
+
+    with st.spinner("Refining SQL..."):
+        tables_context = get_tables_context(sql_generator, results)
+
+        # Refine the SQL
+        refined_result = sql_generator.refine_sql(
+            sql_result['sql_query'],
+            refinement_request,
+            tables_context
+        )
+
+    # Update session state with refined SQL
+    if refined_result['success']:
+        st.session_state.generated_sql = {
+            'sql_query': refined_result['sql_query'],
+            'explanation': refined_result['explanation'],
+            'tables_used': sql_result.get('tables_used', []),
+            'assumptions': [],
+            'alternatives': [],
+            'success': True
+        }
+    else:
+        st.error(f"Error refining SQL: {refined_result.get('error', 'Unknown error')}")
+
+
+def expand_result(source_file: str):
+    """Mark a collapsed search result as expanded (button callback)."""
+    st.session_state.setdefault('expanded_results', set()).add(source_file)
+
+
+@st.fragment
 def display_search_result(result, index):
-    """Display a single search result."""
+    """Display a single search result.
+
+    Only the top result is rendered in full up front. The others show a
+    summary and a "Load details" button, which reruns just this fragment.
+    """
     # Use container instead of expander for stable display
     st.markdown(f"### #{index + 1} - {result.get_table_title()} ({result.get_source_type().upper()})")
     with st.container(border=True):
         col1, col2 = st.columns([2, 1])
 
+        source_file = result.get_source_file()
+        if index > 0 and source_file not in st.session_state.get('expanded_results', set()):
+            with col1:
+                if result.table_metadata:
+                    st.markdown(f"**Location:** `{result.table_metadata.table_loc}`")
+                st.button("Load details", key=f"load_details_{index}", on_click=expand_result, args=(source_file,))
+            with col2:
+                st.metric("Relevance Score", f"{result.relevance_score:.2f}")
+            return
+
         with col1:
-            # Display table metadata
+            # Build the whole details column as one markdown block
+            parts = []
+
+            # Table metadata
             if result.table_metadata:
-                st.markdown("### Table Information")
-                st.write(f"**Location:** `{result.table_metadata.table_loc}`")
-                st.write(f"**Description:** {result.table_metadata.table_description}")
-
-                if result.table_metadata.keywords:
-                    st.write(f"**Keywords:** {', '.join(result.table_metadata.keywords)}")
-
-                # Display columns
-                if result.table_metadata.columns:
-                    st.markdown("### Columns")
-                    for col in result.table_metadata.columns[:10]:  # Show first 10 columns
-                        with st.container():
-                            st.markdown(f"**{col.name}** ({col.datatype})")
-                            if col.description:
-                                st.caption(col.description)
-
-                    if len(result.table_metadata.columns) > 10:
-                        st.caption(f"... and {len(result.table_metadata.columns) - 10} more columns")
-
-            # Display text description
+                meta = result.table_metadata
+                parts.append("### Table Information")
+                parts.append(f"**Location:** `{meta.table_loc}`")
+                parts.append(f"**Description:** {meta.table_description}")
+
+                if meta.keywords:
+                    parts.append(f"**Keywords:** {', '.join(meta.keywords)}")
+
+                # Columns (first 10)
+                if meta.columns:
+                    parts.append("### Columns")
+                    parts.extend(
+                        f"**{col.name}** ({col.datatype})" + (f"  \n{col.description}" if col.description else "")
+                        for col in meta.columns[:10]
+                    )
+
+                    if len(meta.columns) > 10:
+                        parts.append(f"*... and {len(meta.columns) - 10} more columns*")
+
+            # Text description
             if result.table_description:
-                st.markdown("### Summary")
-                st.write(f"**Purpose:** {result.table_description.purpose}")
+                desc = result.table_description
+                parts.append("### Summary")
+                parts.append(f"**Purpose:** {desc.purpose}")
+
+                if desc.key_features:
+                    parts.append("**Key Features:**\n" + "\n".join(f"- {feature}" for feature in desc.key_features[:5]))
 
-                if result.table_description.key_features:
-                    st.write("**Key Features:**")
-                    for feature in result.table_description.key_features[:5]:
-                        st.write(f"- {feature}")
+                if desc.joinable_features:
+                    parts.append("**Joinable Features:**\n" + "\n".join(f"- {feature}" for feature in desc.joinable_features[:5]))
 
-                if result.table_description.joinable_features:
-                    st.write("**Joinable Features:**")
-                    for feature in result.table_description.joinable_features[:5]:
-                        st.write(f"- {feature}")
+            st.markdown("\n\n".join(parts))
 
         with col2:
             st.markdown("### Match Details")
             st.metric("Relevance Score", f"{result.relevance_score:.2f}")
 
-            st.markdown("**Match Reasons:**")
-            for reason in result.match_reasons[:5]:
-                st.caption(f"- {reason}")
-
+            reasons = [f"- {reason}" for reason in result.match_reasons[:5]]
             if len(result.match_reasons) > 5:
-                st.caption(f"... and {len(result.match_reasons) - 5} more matches")
+                reasons.append(f"- ... and {len(result.match_reasons) - 5} more matches")
+            st.markdown("**Match Reasons:**\n" + "\n".join(reasons))
 
 
 def main():
@@ -117,18 +364,19 @@ def main():
     st.markdown("Describe your data needs → Get SQL automatically")
 
     # Initialize system
-    search_engine, sql_generator, metadata, mode = initialize_system()
+    search_engine, counts = initialize_system()
+    client, model, mode = get_llm_client()
+    sql_generator = get_sql_generator(client, model, id(client))
 
     # Sidebar
     with st.sidebar:
         st.markdown(f"### System Info")
         st.info(f"**LLM Mode:** {mode}")
 
-        if metadata:
-            yaml_metadata, txt_descriptions = metadata
-            st.metric("Total Tables", len(yaml_metadata))
-            st.metric("AVS Tables", len([m for m in yaml_metadata if m.source_type == 'avs']))
-            st.metric("DLVS Tables", len([m for m in yaml_metadata if m.source_type == 'dlvs']))
+        if counts is not None:
+            st.metric("Total Tables", sum(counts.values()))
+            st.metric("AVS Tables", counts.get('avs', 0))
+            st.metric("DLVS Tables", counts.get('dlvs', 0))
 
         st.markdown("---")
         st.markdown("### Filters")
@@ -167,9 +415,9 @@ def main():
         """)
         return
 
-    # Initialize session state
+    # Initialize session state (kept small: Streamlit never frees it for closed tabs)
     if 'conversation_history' not in st.session_state:
-        st.session_state.conversation_history = []
+        st.session_state.conversation_history = deque(maxlen=MAX_HISTORY_MESSAGES)
 
     if 'last_query' not in st.session_state:
         st.session_state.last_query = ""
@@ -200,13 +448,7 @@ def main():
         search_and_generate_button = st.button("🎯 Search & Generate SQL", type="primary", use_container_width=True)
 
     with col2:
-        if st.button("🗑️ Clear", use_container_width=True):
-            st.session_state.conversation_history = []
-            st.session_state.last_query = ""
-            st.session_state.current_query = ""
-            st.session_state.last_results = []
-            st.session_state.generated_sql = None
-            st.rerun()
+        st.button("🗑️ Clear", use_container_width=True, on_click=clear_session)
 
     # Process search and SQL generation (combined operation)
     if query and search_and_generate_button:
@@ -217,29 +459,23 @@ def main():
             source_type = None if source_filter == "All" else source_filter.lower()
 
             # Perform search
-            results = search_engine.search(query, source_type=source_type, max_results=max_results)
+            results = search_tables(search_engine, query, source_type, max_results)
 
-            # Store in session state
-            st.session_state.last_results = results
+            # Store lightweight rows in session state
+            st.session_state.last_results = to_rows(results)
 
         # If we found results, automatically generate SQL
         if results:
-            with st.spinner("Generating SQL query..."):
-                sql_result = sql_generator.generate_sql(
-                    user_query=query,
-                    search_results=results,
-                    conversation_history=st.session_state.conversation_history
-                )
+            sql_result = generate_sql(sql_generator, query, results, list(st.session_state.conversation_history))
 
-                # Store in session state
-                st.session_state.generated_sql = sql_result
+            # Store in session state
+            st.session_state.generated_sql = sql_result
 
-        st.rerun()
+    # Rebuild results from the stored rows
+    results = from_rows(search_engine, st.session_state.get('last_results') or [])
 
     # Display search results (separate from search execution)
-    if 'last_results' in st.session_state and st.session_state.last_results is not None:
-        results = st.session_state.last_results
-
+    if st.session_state.get('last_results') is not None:
         st.markdown("---")
         st.markdown(f"## Search Results ({len(results)} found)")
 
@@ -250,48 +486,20 @@ def main():
             st.warning("No results found. Try different keywords or browse all tables.")
 
     # Display generated SQL if available
-    if 'generated_sql' in st.session_state and st.session_state.generated_sql:
-        sql_result = st.session_state.generated_sql
-        results = st.session_state.get('last_results', [])
-
-        refine_button, refinement_request = display_generated_sql(sql_result, results)
-
-        # Handle SQL refinement
-        if refine_button and refinement_request:
-            with st.spinner("Refining SQL..."):
-                # Build tables context
-                tables_context = sql_generator._build_tables_context(
-                    results,
-                    list(range(min(3, len(results))))
-                )
-
-                # Refine the SQL
-                refined_result = sql_generator.refine_sql(
-                    sql_result['sql_query'],
-                    refinement_request,
-                    tables_context
-                )
-
-                # Update session state with refined SQL
-                if refined_result['success']:
-                    st.session_state.generated_sql = {
-                        'sql_query': refined_result['sql_query'],
-                        'explanation': refined_result['explanation'],
-                        'tables_used': sql_result.get('tables_used', []),
-                        'assumptions': [],
-                        'alternatives': [],
-                        'success': True
-                    }
-                    st.rerun()
-                else:
-                    st.error(f"Error refining SQL: {refined_result.get('error', 'Unknown error')}")
+    if st.session_state.get('generated_sql'):
+        # Apply a requested refinement before rendering, so this run shows it
+        refinement_request = st.session_state.get('sql_refinement_input')
+        if st.session_state.get('refine_sql_button') and refinement_request:
+            refine_generated_sql(sql_generator, results, refinement_request)
+
+        display_generated_sql(st.session_state.generated_sql, results)
 
     # Show conversation history
     if st.session_state.conversation_history:
         with st.sidebar:
             st.markdown("---")
             st.markdown("### Recent Queries")
-            for i, msg in enumerate(reversed(st.session_state.conversation_history[-6:])):
+            for i, msg in enumerate(reversed(list(st.session_state.conversation_history)[-6:])):
                 if msg['role'] == 'user':
                     st.caption(f"🔍 {msg['content'][:50]}...")
 
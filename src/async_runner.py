@@ -0,0 +1,60 @@
+"""Shared background event loop for running async LLM calls from sync code."""
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+# Global state for the background loop
+_loop = None
+_loop_lock = threading.Lock()
+_llm_semaphore = None
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use.
+
+    Async OpenAI clients keep a connection pool bound to the loop they first
+    ran on, so every call must go through the same long-lived loop rather
+    than a fresh ``asyncio.run`` per Streamlit rerun.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+    return _loop
+
+
+def is_loop_running() -> bool:
+    """Return whether the shared loop has been started, without starting it."""
+    with _loop_lock:
+        return _loop is not None and _loop.is_running()
+
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and block until it returns."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def submit_async(coro) -> concurrent.futures.Future:
+    """Schedule a coroutine on the shared loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def iterate_async(agen):
+    """Consume an async generator on the shared loop as a regular iterator."""
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
+
+
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore bounding concurrent LLM requests."""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "10")))
+    return _llm_semaphore
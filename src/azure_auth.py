@@ -1,52 +1,116 @@
+import asyncio
 import os
-from datetime import datetime, timedelta
-from azure.identity import CertificateCredential
-from openai import AzureOpenAI
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Set proxy environment variables if configured in .env
-if os.getenv("HTTP_PROXY"):
-    os.environ["http_proxy"] = os.getenv("HTTP_PROXY")
-if os.getenv("HTTPS_PROXY"):
-    os.environ["https_proxy"] = os.getenv("HTTPS_PROXY")
-if os.getenv("NO_PROXY"):
-    os.environ["no_proxy"] = os.getenv("NO_PROXY")
+import time
+from datetime import datetime
+from env_init import init_env
+from async_runner import submit_async
+
+# Load environment variables and proxy settings
+init_env()
+
+SCOPE = "https://cognitiveservices.azure.com/.default"
+CERT_PATH = "./cert/apim-exp.pem"
+
+# Refresh tokens (and the client carrying them) this many seconds before expiry
+TOKEN_REFRESH_MARGIN_SECONDS = 5 * 60
 
 # Global variables for token management
+_credential = None
 access_token = None
 token_expiration = None
+_token_refresh_at = 0.0  # time.monotonic() deadline for the next refresh
+
+# Cached client, rebuilt only when the token in its headers expires
+_client_cache = {'client': None, 'refresh_at': 0.0}
+
+def get_credential():
+    """Return the shared certificate credential, creating it on first use.
+
+    Tokens are kept in azure-identity's persistent cache, so a restarted
+    process reuses a still-valid token instead of going back to AAD.
+    """
+    global _credential
+    if _credential is None:
+        _credential = _build_credential(persistent_cache=True)
+    return _credential
+
+def _build_credential(persistent_cache: bool):
+    """Build the certificate credential, optionally with a persistent token cache."""
+    # Imported lazily: azure-identity is only needed in Azure mode
+    from azure.identity import CertificateCredential, TokenCachePersistenceOptions
+
+    options = {}
+    if persistent_cache:
+        options['cache_persistence_options'] = TokenCachePersistenceOptions(
+            name="apim-exp",
+            allow_unencrypted_storage=os.getenv("AZURE_TOKEN_CACHE_UNENCRYPTED", "false").lower() == "true"
+        )
+
+    return CertificateCredential(
+        client_id=os.environ["AZURE_SPN_CLIENT_ID"],
+        certificate_path=CERT_PATH,
+        tenant_id=os.environ["AZURE_TENANT_ID"],
+        scope=SCOPE,
+        logging_enable=False,
+        **options
+    )
 
 def get_access_token():
     """Authenticate and return a valid access token."""
-    global access_token, token_expiration
-    if access_token is None or datetime.now() >= token_expiration:
-        cert_path = "./cert/apim-exp.pem"
-        scope = "https://cognitiveservices.azure.com/.default"
-        credential = CertificateCredential(
-            client_id=os.environ["AZURE_SPN_CLIENT_ID"],
-            certificate_path=cert_path,
-            tenant_id=os.environ["AZURE_TENANT_ID"],
-            scope=scope,
-            logging_enable=False
-        )
-        token_response = credential.get_token(scope)
+    global _credential, access_token, token_expiration, _token_refresh_at
+    if access_token is None or time.monotonic() >= _token_refresh_at:
+        try:
+            token_response = get_credential().get_token(SCOPE)
+        except ValueError as e:
+            # The persistent cache is opened on first use and can't be encrypted
+            # without a keyring (e.g. headless Linux); keep tokens in memory instead
+            print(f"Error opening persistent token cache, using an in-memory cache: {e}")
+            _credential = _build_credential(persistent_cache=False)
+            token_response = _credential.get_token(SCOPE)
         access_token = token_response.token
-        token_expiration = datetime.now() + timedelta(seconds=token_response.expires_on - datetime.now().timestamp())
+        token_expiration = datetime.fromtimestamp(token_response.expires_on)
+
+        # Convert the epoch expiry to a monotonic deadline once, so wall-clock
+        # adjustments can't trigger early (or late) refreshes
+        remaining = token_response.expires_on - time.time()
+        _token_refresh_at = time.monotonic() + remaining - TOKEN_REFRESH_MARGIN_SECONDS
     return access_token
 
 def setup_azure_openai_client():
-    """Set up the Azure OpenAI client using the acquired token."""
+    """Return the async Azure OpenAI client, rebuilding it when its token expires.
+
+    The bearer token is baked into the client's default headers, so a client
+    is reused (keeping its connection pool) only while that token is valid.
+    """
+    if _client_cache['client'] and time.monotonic() < _client_cache['refresh_at']:
+        return _client_cache['client']
+
+    from openai import AsyncAzureOpenAI
+
     token = get_access_token()
-    client = AzureOpenAI(
+    client = AsyncAzureOpenAI(
         api_key=os.environ["AZURE_OPENAI_API_KEY"],
         azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
         api_version=os.environ["AZURE_OPENAI_API_VERSION"],
         default_headers={
             "Authorization": f"Bearer {token}",
             "user-sid": os.getenv("USER_SID", ""),
-        }
+        },
+        max_retries=0  # llm_throttle retries, in step with its rate limiting
     )
-    return client
\ No newline at end of file
+    old_client = _client_cache['client']
+    _client_cache['client'] = client
+    _client_cache['refresh_at'] = _token_refresh_at
+
+    if old_client is not None:
+        submit_async(_close_client_later(old_client))
+    return client
+
+async def _close_client_later(client):
+    """Close a replaced client once requests already using it have had time to finish.
+
+    Its token stays valid for TOKEN_REFRESH_MARGIN_SECONDS after the refresh,
+    so requests still running on it can't usefully outlive that anyway.
+    """
+    await asyncio.sleep(TOKEN_REFRESH_MARGIN_SECONDS)
+    await client.close()
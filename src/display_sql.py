@@ -58,6 +58,6 @@ def display_generated_sql(sql_result, results):
 
     with refine_col2:
         st.write("")  # Spacing
-        refine_sql_button = st.button("🔄 Refine SQL", use_container_width=True)
+        refine_sql_button = st.button("🔄 Refine SQL", use_container_width=True, key="refine_sql_button")
 
     return refine_sql_button, refinement_request
@@ -0,0 +1,27 @@
+"""One-time environment setup (.env loading and proxy variables)."""
+import os
+from dotenv import load_dotenv
+
+# Set once init_env has run in this process
+_done = False
+
+
+def _apply_proxy():
+    """Copy proxy settings from .env to the lowercase vars HTTP clients read.
+
+    Variables that are already set are left alone.
+    """
+    for source, target in (("HTTP_PROXY", "http_proxy"), ("HTTPS_PROXY", "https_proxy"), ("NO_PROXY", "no_proxy")):
+        if os.getenv(source) and target not in os.environ:
+            os.environ[target] = os.getenv(source)
+
+
+def init_env():
+    """Load .env and apply proxy settings, once per process."""
+    global _done
+    if _done:
+        return
+
+    load_dotenv(override=False)
+    _apply_proxy()
+    _done = True
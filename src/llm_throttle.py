@@ -0,0 +1,98 @@
+"""Client-side rate limiting and retry for LLM chat completion calls."""
+import asyncio
+import functools
+import os
+import random
+import time
+from typing import Dict, List
+
+from openai import APIConnectionError, RateLimitError
+
+from async_runner import get_llm_semaphore
+
+# Retry settings (waits double per attempt: 1s, 2s, ... capped)
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+BACKOFF_JITTER_SECONDS = 1.0
+
+# Completion size assumed when the caller does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# Global buckets, created on first use so .env values are picked up
+_request_bucket = None
+_token_bucket = None
+
+
+class _LeakyBucket:
+    """Capacity that refills continuously up to a per-minute limit."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float):
+        """Wait until `amount` capacity is available, then consume it."""
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(
+                    self.capacity,
+                    self.available + (now - self.updated) * self.capacity / 60.0
+                )
+                self.updated = now
+
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+
+                await asyncio.sleep((amount - self.available) * 60.0 / self.capacity)
+
+
+def _get_buckets():
+    """Return the shared (requests, tokens) buckets."""
+    global _request_bucket, _token_bucket
+    if _request_bucket is None:
+        # Defaults follow the OpenAI cookbook's api_request_parallel_processor
+        _request_bucket = _LeakyBucket(float(os.getenv("LLM_MAX_REQUESTS_PER_MINUTE", 3_000 * 0.5)))
+        _token_bucket = _LeakyBucket(float(os.getenv("LLM_MAX_TOKENS_PER_MINUTE", 250_000 * 0.5)))
+    return _request_bucket, _token_bucket
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Roughly estimate prompt tokens (~4 characters per token)."""
+    return sum(4 + len(msg.get("content") or "") // 4 for msg in messages)
+
+
+def throttled_chat_completion(func):
+    """Pace an async chat completion call and retry it on rate limits.
+
+    The wrapped coroutine must receive the chat `messages` list, either as
+    the `messages` keyword or as a positional argument.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        messages = kwargs.get("messages")
+        if messages is None:
+            messages = next((arg for arg in args if isinstance(arg, list)), [])
+        tokens = estimate_tokens(messages) + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+        request_bucket, token_bucket = _get_buckets()
+
+        for attempt in range(MAX_ATTEMPTS):
+            await request_bucket.acquire(1)
+            await token_bucket.acquire(tokens)
+
+            try:
+                async with get_llm_semaphore():
+                    return await func(*args, **kwargs)
+            except (RateLimitError, APIConnectionError):
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, BACKOFF_JITTER_SECONDS))
+
+    return wrapper
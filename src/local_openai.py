@@ -1,13 +1,42 @@
+import atexit
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from env_init import init_env
+from async_runner import is_loop_running, run_async
 
 # Load environment variables
-load_dotenv()
+init_env()
+
+# Connection pool limits for the shared HTTP client
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+# Global client, shared across Streamlit reruns
+_client = None
 
 def setup_local_openai_client():
-    """Set up the standard OpenAI client for local development."""
-    client = OpenAI(
-        api_key=os.environ["OPENAI_API_KEY"]
-    )
-    return client
+    """Set up the async OpenAI client for local development."""
+    global _client
+    if _client is None:
+        # One pooled HTTP client, so keep-alive connections are reused across calls
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+        _client = AsyncOpenAI(
+            api_key=os.environ["OPENAI_API_KEY"],
+            http_client=http_client,
+            max_retries=0  # llm_throttle retries, in step with its rate limiting
+        )
+        atexit.register(_close_client)
+    return _client
+
+def _close_client():
+    """Close the shared client's connections on interpreter exit."""
+    # Without a running loop no request was made, so there is nothing to close;
+    # starting the loop thread now would fail during interpreter shutdown
+    if _client is not None and is_loop_running():
+        run_async(_client.close())
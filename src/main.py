@@ -1,16 +1,33 @@
 import os
-from dotenv import load_dotenv
-from azure_auth import setup_azure_openai_client
+from collections import deque
+from env_init import init_env
 from local_openai import setup_local_openai_client
+from async_runner import iterate_async
 
 # Load environment variables
-load_dotenv()
+init_env()
+
+# Maximum number of conversation messages kept (and re-sent with each request)
+MAX_HISTORY_MESSAGES = 20
+
+async def stream_reply(client, model, messages):
+    """Yield the assistant's reply text as it streams in."""
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True
+    )
+
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
 def main():
     # Determine which client to use based on USE_AZURE environment variable
     use_azure = os.getenv("USE_AZURE", "false").lower() == "true"
 
     if use_azure:
+        from azure_auth import setup_azure_openai_client
         client = setup_azure_openai_client()
         model = os.environ["AZURE_OPENAI_MODEL"]
         mode = "Azure OpenAI"
@@ -19,7 +36,7 @@ def main():
         model = os.environ["OPENAI_MODEL"]
         mode = "OpenAI"
 
-    messages = []
+    messages = deque(maxlen=MAX_HISTORY_MESSAGES)
 
     print(f"{mode} Chat Assistant. Type 'exit' to quit.")
 
@@ -31,20 +48,18 @@ def main():
         # Add user message to conversation history
         messages.append({"role": "user", "content": user_input})
 
-        # Call OpenAI (Azure or standard)
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
+        # Call OpenAI (Azure or standard), printing the response as it streams
+        print("\nAssistant: ", end="", flush=True)
+        parts = []
+        for text in iterate_async(stream_reply(client, model, list(messages))):
+            print(text, end="", flush=True)
+            parts.append(text)
+        print()
 
-        # Get the assistant's response
-        assistant_response = response.choices[0].message.content
+        assistant_response = "".join(parts)
 
         # Add assistant response to conversation history
         messages.append({"role": "assistant", "content": assistant_response})
 
-        # Display the response
-        print("\nAssistant:", assistant_response)
-
 if __name__ == '__main__':
     main()
\ No newline at end of file
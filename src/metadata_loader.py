@@ -1,117 +1,193 @@
 """Loads and parses metadata from YAML and TXT files."""
 import os
+import pickle
+import sys
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from models import TableMetadata, TableDescription, ColumnMetadata
 
+# Prefer the libyaml-backed loader; fall back to pure Python if it isn't built
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Parsed metadata, reused while the metadata files are unchanged
+METADATA_CACHE_FILE = ".metadata_cache.pkl"
+
+# Bump when the cached model classes change so old caches are rebuilt
+METADATA_CACHE_VERSION = 2
+
+# TXT description line prefixes and the fields they fill
+_TXT_FIELDS = {
+    'Table Name': 'table_name',
+    'Purpose': 'purpose',
+    'Key Features': 'key_features',
+    'Joinable Features': 'joinable_features',
+}
+_TXT_LIST_FIELDS = {'key_features', 'joinable_features'}
+
+
+def _intern(value):
+    """Intern a string so repeated values share one object; other values pass through."""
+    return sys.intern(value) if isinstance(value, str) else value
+
 
 class MetadataLoader:
     """Loads metadata from data directory structure."""
 
     def __init__(self, data_dir: str = "data"):
         self.data_dir = Path(data_dir)
+        self.fingerprint = None  # set by load_all_metadata
 
     def load_all_metadata(self) -> Tuple[List[TableMetadata], List[TableDescription]]:
         """Load all YAML and TXT metadata files."""
-        yaml_metadata = []
-        txt_descriptions = []
+        yaml_files = []
+        txt_files = []
 
-        # Load from both avs and dlvs
+        # Collect files from both avs and dlvs
         for source_type in ['avs', 'dlvs']:
             source_path = self.data_dir / source_type
 
-            # Load YAML files
+            # YAML files
             yaml_path = source_path / 'extracted_metadata'
             if yaml_path.exists():
-                yaml_metadata.extend(self._load_yaml_files(yaml_path, source_type))
+                yaml_files.extend((entry, source_type) for entry in self._scan_files(yaml_path, '.yaml'))
 
-            # Load TXT files
+            # TXT files
             txt_path = source_path / 'extracted_metadata_desc'
             if txt_path.exists():
-                txt_descriptions.extend(self._load_txt_files(txt_path, source_type))
+                txt_files.extend((entry, source_type) for entry in self._scan_files(txt_path, '.txt'))
+
+        # Reuse the parsed results if no file was added, removed or modified
+        self.fingerprint = self._fingerprint(yaml_files + txt_files)
+        cache_path = self.data_dir / METADATA_CACHE_FILE
+        cached = self._load_cache(cache_path, self.fingerprint)
+        if cached is not None:
+            return cached
+
+        # Load every file in one pool; file reads release the GIL
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yaml_futures = [executor.submit(self._load_one_yaml, path, source_type) for path, source_type in yaml_files]
+            txt_futures = [executor.submit(self._load_one_txt, path, source_type) for path, source_type in txt_files]
+
+            yaml_metadata = [m for m in (f.result() for f in yaml_futures) if m is not None]
+            txt_descriptions = [d for d in (f.result() for f in txt_futures) if d is not None]
+
+        try:
+            self._save_cache(cache_path, self.fingerprint, (yaml_metadata, txt_descriptions))
+        except OSError as e:
+            print(f"Error saving metadata cache: {e}")
 
         return yaml_metadata, txt_descriptions
 
-    def _load_yaml_files(self, yaml_dir: Path, source_type: str) -> List[TableMetadata]:
-        """Load all YAML files from a directory."""
-        metadata_list = []
-
-        for yaml_file in yaml_dir.glob('*.yaml'):
-            try:
-                with open(yaml_file, 'r', encoding='utf-8') as f:
-                    data = yaml.safe_load(f)
-
-                # Parse columns
-                columns = []
-                for col_data in data.get('columns', []):
-                    # Handle both 'colums' typo and 'columns'
-                    if isinstance(col_data, dict):
-                        columns.append(ColumnMetadata(
-                            name=col_data.get('name', ''),
-                            title=col_data.get('title', ''),
-                            description=col_data.get('description', ''),
-                            datatype=col_data.get('datatype', 'Unknown'),
-                            required=col_data.get('required', False)
-                        ))
-
-                # Also check for 'colums' typo
-                for col_data in data.get('colums', []):
-                    if isinstance(col_data, dict):
-                        columns.append(ColumnMetadata(
-                            name=col_data.get('name', ''),
-                            title=col_data.get('title', ''),
-                            description=col_data.get('description', ''),
-                            datatype=col_data.get('datatype', 'Unknown'),
-                            required=col_data.get('required', False)
-                        ))
-
-                metadata = TableMetadata(
-                    seal_id=data.get('seal_id'),
-                    dataset_id=data.get('dataset_id', ''),
-                    table_loc=data.get('table_loc', ''),
-                    table_title=data.get('table_title', ''),
-                    table_description=data.get('table_description', ''),
-                    keywords=data.get('keywords', []),
-                    columns=columns,
-                    source_file=yaml_file.name,
-                    source_type=source_type
-                )
-
-                metadata_list.append(metadata)
-
-            except Exception as e:
-                print(f"Error loading {yaml_file}: {e}")
-
-        return metadata_list
-
-    def _load_txt_files(self, txt_dir: Path, source_type: str) -> List[TableDescription]:
-        """Load all TXT description files from a directory."""
-        descriptions = []
-
-        for txt_file in txt_dir.glob('*.txt'):
-            try:
-                with open(txt_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                # Parse the structured text
-                parsed = self._parse_txt_content(content)
-
-                description = TableDescription(
-                    table_name=parsed.get('table_name', ''),
-                    purpose=parsed.get('purpose', ''),
-                    key_features=parsed.get('key_features', []),
-                    joinable_features=parsed.get('joinable_features', []),
-                    source_file=txt_file.name,
-                    source_type=source_type
-                )
-
-                descriptions.append(description)
-
-            except Exception as e:
-                print(f"Error loading {txt_file}: {e}")
-
-        return descriptions
+    @staticmethod
+    def _fingerprint(files: List[Tuple[os.DirEntry, str]]) -> tuple:
+        """Identify a set of files by source type, name, mtime and size."""
+        return tuple(sorted(
+            (source_type, entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry, source_type in files
+        ))
+
+    @staticmethod
+    def _load_cache(path: Path, fingerprint: tuple):
+        """Return cached (yaml_metadata, txt_descriptions), or None if missing or stale."""
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception:
+            # Missing, truncated, or pickled from incompatible model classes
+            return None
+
+        if payload.get('version') != METADATA_CACHE_VERSION or payload.get('fingerprint') != fingerprint:
+            return None
+
+        return payload['metadata']
+
+    @staticmethod
+    def _save_cache(path: Path, fingerprint: tuple, metadata):
+        """Persist parsed metadata, tagged with the fingerprint of its source files."""
+        payload = {
+            'version': METADATA_CACHE_VERSION,
+            'fingerprint': fingerprint,
+            'metadata': metadata,
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _scan_files(directory: Path, suffix: str) -> List[os.DirEntry]:
+        """List the files in a directory ending with suffix."""
+        with os.scandir(directory) as entries:
+            return [entry for entry in entries if entry.name.endswith(suffix) and entry.is_file()]
+
+    def _load_one_yaml(self, yaml_file: os.DirEntry, source_type: str) -> Optional[TableMetadata]:
+        """Load one YAML metadata file, or return None if it can't be parsed."""
+        try:
+            with open(yaml_file.path, 'r', encoding='utf-8') as f:
+                data = yaml.load(f, Loader=_YamlLoader)
+
+            # Parse columns, handling both 'columns' and the 'colums' typo
+            columns = []
+            for col_data in chain(data.get('columns', []), data.get('colums', [])):
+                if not isinstance(col_data, dict):
+                    continue
+
+                col_get = col_data.get
+                columns.append(ColumnMetadata(
+                    name=col_get('name', ''),
+                    title=col_get('title', ''),
+                    description=col_get('description', ''),
+                    datatype=_intern(col_get('datatype', 'Unknown')),
+                    required=col_get('required', False)
+                ))
+
+            # Keywords repeat across many tables
+            keywords = data.get('keywords', [])
+            if isinstance(keywords, list):
+                keywords = [_intern(keyword) for keyword in keywords]
+
+            return TableMetadata(
+                seal_id=data.get('seal_id'),
+                dataset_id=data.get('dataset_id', ''),
+                table_loc=data.get('table_loc', ''),
+                table_title=data.get('table_title', ''),
+                table_description=data.get('table_description', ''),
+                keywords=keywords,
+                columns=columns,
+                source_file=yaml_file.name,
+                source_type=source_type
+            )
+
+        except Exception as e:
+            print(f"Error loading {yaml_file.path}: {e}")
+            return None
+
+    def _load_one_txt(self, txt_file: os.DirEntry, source_type: str) -> Optional[TableDescription]:
+        """Load one TXT description file, or return None if it can't be read."""
+        try:
+            with open(txt_file.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+
+            # Parse the structured text
+            parsed = self._parse_txt_content(content)
+
+            return TableDescription(
+                table_name=parsed.get('table_name', ''),
+                purpose=parsed.get('purpose', ''),
+                key_features=parsed.get('key_features', []),
+                joinable_features=parsed.get('joinable_features', []),
+                source_file=txt_file.name,
+                source_type=source_type
+            )
+
+        except Exception as e:
+            print(f"Error loading {txt_file.path}: {e}")
+            return None
 
     def _parse_txt_content(self, content: str) -> dict:
         """Parse the structured text content."""
@@ -123,24 +199,20 @@ class MetadataLoader:
             'joinable_features': []
         }
 
-        current_field = None
-
         for line in lines:
             line = line.strip()
             if not line:
                 continue
 
-            if line.startswith('Table Name:'):
-                parsed['table_name'] = line.replace('Table Name:', '').strip()
-            elif line.startswith('Purpose:'):
-                parsed['purpose'] = line.replace('Purpose:', '').strip()
-            elif line.startswith('Key Features:'):
-                # Parse comma-separated features
-                features_str = line.replace('Key Features:', '').strip()
-                parsed['key_features'] = [f.strip() for f in features_str.split(',') if f.strip()]
-            elif line.startswith('Joinable Features:'):
+            head, _, rest = line.partition(':')
+            field = _TXT_FIELDS.get(head)
+            if field is None:
+                continue
+
+            if field in _TXT_LIST_FIELDS:
                 # Parse comma-separated features
-                features_str = line.replace('Joinable Features:', '').strip()
-                parsed['joinable_features'] = [f.strip() for f in features_str.split(',') if f.strip()]
+                parsed[field] = [f.strip() for f in rest.split(',') if f.strip()]
+            else:
+                parsed[field] = rest.strip()
 
         return parsed
@@ -1,9 +1,24 @@
 """Data models for the Query Suggestion System."""
-from dataclasses import dataclass, field
+import json
+from dataclasses import dataclass, field, fields, is_dataclass
+from itertools import islice
 from typing import List, Optional, Dict, Any
 
 
-@dataclass
+class ModelJSONEncoder(json.JSONEncoder):
+    """JSON encoder that serializes the dataclass models field by field.
+
+    json.dumps(table_metadata, cls=ModelJSONEncoder) gives the same JSON as
+    json.dumps(table_metadata.to_dict()) without building the intermediate dicts.
+    """
+
+    def default(self, o):
+        if is_dataclass(o) and not isinstance(o, type):
+            return {f.name: getattr(o, f.name) for f in fields(o)}
+        return super().default(o)
+
+
+@dataclass(slots=True)
 class ColumnMetadata:
     """Represents metadata for a single column."""
     name: str
@@ -13,7 +28,7 @@ class ColumnMetadata:
     required: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class TableMetadata:
     """Represents detailed metadata from YAML files."""
     seal_id: Optional[int]
@@ -50,7 +65,7 @@ class TableMetadata:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class TableDescription:
     """Represents simplified metadata from TXT files."""
     table_name: str
@@ -72,13 +87,14 @@ class TableDescription:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class SearchResult:
     """Represents a search result with relevance score."""
     table_metadata: Optional[TableMetadata]
     table_description: Optional[TableDescription]
     relevance_score: float
     match_reasons: List[str]  # Why this result matched
+    context_snippet: Optional[str] = None  # Prompt text for this table, precomputed by the search engine
 
     def get_table_title(self) -> str:
         """Get the table title from available sources."""
@@ -96,8 +112,58 @@ class SearchResult:
             return self.table_description.source_type
         return "unknown"
 
+    def get_source_file(self) -> str:
+        """Get the source file that identifies this table in the search index."""
+        if self.table_metadata:
+            return self.table_metadata.source_file
+        elif self.table_description:
+            return self.table_description.source_file
+        return ""
+
+    def get_context_snippet(self) -> str:
+        """Get this table's prompt context, rendering it if it wasn't precomputed."""
+        if self.context_snippet is None:
+            self.context_snippet = render_table_context(self.table_metadata, self.table_description)
+        return self.context_snippet
+
+
+def render_table_context(
+    table_metadata: Optional[TableMetadata],
+    table_description: Optional[TableDescription]
+) -> str:
+    """Format one table and its columns for an LLM prompt."""
+    parts = []
+
+    # Build table context
+    if table_metadata:
+        meta = table_metadata
+        header = f"\nTable: {meta.table_loc}\nDescription: {meta.table_description}\n\nColumns:"
+
+        # Limit to 20 columns, without copying the column list
+        column_lines = "".join(
+            f"\n  - {col.name} ({col.datatype}): {col.description}" if col.description
+            else f"\n  - {col.name} ({col.datatype})"
+            for col in islice(meta.columns, 20)
+        )
+
+        if len(meta.columns) > 20:
+            column_lines += f"\n  ... and {len(meta.columns) - 20} more columns"
+
+        parts.append(header + column_lines)
+
+    # Add description info if available
+    if table_description:
+        desc = table_description
+        parts.append(f"\nPurpose: {desc.purpose}")
+
+        if desc.joinable_features:
+            parts.append(f"Joinable on: {', '.join(desc.joinable_features[:5])}")
+
+    # Parts are separated by a blank line
+    return "\n\n".join(parts)
+
 
-@dataclass
+@dataclass(slots=True)
 class QueryRefinement:
     """Represents a query refinement suggestion."""
     original_query: str
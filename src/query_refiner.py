@@ -2,6 +2,13 @@
 import json
 from typing import List, Optional, Dict, Any
 from models import QueryRefinement, SearchResult
+from async_runner import run_async
+from llm_throttle import throttled_chat_completion
+
+# Common words dropped from extracted search keywords
+_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'in', 'on', 'at', 'for', 'with', 'about', 'show', 'me', 'find', 'search', 'list', 'all'
+})
 
 
 class QueryRefiner:
@@ -11,7 +18,20 @@ class QueryRefiner:
         self.client = llm_client
         self.model = model
 
+    @throttled_chat_completion
+    async def _chat(self, messages: List[Dict[str, str]], **kwargs):
+        """Send a rate-limited chat completion request."""
+        return await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            **kwargs
+        )
+
     def analyze_query(self, query: str, search_results: List[SearchResult], conversation_history: List[Dict[str, str]]) -> QueryRefinement:
+        """Blocking wrapper around analyze_query_async."""
+        return run_async(self.analyze_query_async(query, search_results, conversation_history))
+
+    async def analyze_query_async(self, query: str, search_results: List[SearchResult], conversation_history: List[Dict[str, str]]) -> QueryRefinement:
         """
         Analyze a user query and suggest refinements.
 
@@ -64,22 +84,13 @@ Please analyze this query and provide suggestions to help the user find what the
         messages.append({"role": "user", "content": user_prompt})
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
+            # JSON mode returns a bare JSON object, with no markdown fences to strip
+            response = await self._chat(messages, response_format={"type": "json_object"})
 
             llm_response = response.choices[0].message.content
 
             # Parse JSON response
-            # Try to extract JSON from response (handle markdown code blocks)
-            json_match = llm_response
-            if "```json" in llm_response:
-                json_match = llm_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in llm_response:
-                json_match = llm_response.split("```")[1].split("```")[0].strip()
-
-            parsed = json.loads(json_match)
+            parsed = json.loads(llm_response)
 
             return QueryRefinement(
                 original_query=query,
@@ -143,6 +154,7 @@ Please analyze this query and provide suggestions to help the user find what the
         - intent: 'search', 'browse', 'describe'
         """
         query_lower = query.lower()
+        words_lower = query_lower.split()
 
         intent = {
             'keywords': [],
@@ -161,8 +173,8 @@ Please analyze this query and provide suggestions to help the user find what the
         if 'column' in query_lower or 'field' in query_lower:
             # Try to extract column name
             words = query.split()
-            for i, word in enumerate(words):
-                if word.lower() in ['column', 'field'] and i + 1 < len(words):
+            for i, word in enumerate(words_lower):
+                if word in ('column', 'field') and i + 1 < len(words):
                     intent['column_name'] = words[i + 1].strip('":,.')
                     break
 
@@ -172,8 +184,10 @@ Please analyze this query and provide suggestions to help the user find what the
 
         # Extract keywords (simple approach)
         # Remove common words and extract meaningful terms
-        stop_words = {'the', 'a', 'an', 'in', 'on', 'at', 'for', 'with', 'about', 'show', 'me', 'find', 'search', 'list', 'all'}
-        words = query_lower.split()
-        intent['keywords'] = [w.strip('.,!?":;') for w in words if w.strip('.,!?":;') not in stop_words and len(w) > 2]
+        stripped = [w.strip('.,!?":;') for w in words_lower]
+        intent['keywords'] = [
+            term for word, term in zip(words_lower, stripped)
+            if term not in _STOP_WORDS and len(word) > 2
+        ]
 
         return intent
@@ -1,25 +1,65 @@
 """Search engine for metadata with keyword and semantic search."""
+import heapq
+import pickle
 import re
-from typing import List, Dict, Set
-from models import TableMetadata, TableDescription, SearchResult
+import sys
+from collections import Counter, defaultdict
+from typing import Callable, List, Dict, Set, Optional, Tuple
+from models import TableMetadata, TableDescription, SearchResult, render_table_context
+
+# Bump when the persisted index layout changes so old files are rebuilt
+INDEX_FORMAT_VERSION = 2
+
+# Alphanumeric word tokenizer used for both indexing and queries
+_WORD_RE = re.compile(r'\b\w+\b')
 
 
 class SearchEngine:
     """Searches through metadata using keyword matching and scoring."""
 
-    def __init__(self, yaml_metadata: List[TableMetadata], txt_descriptions: List[TableDescription]):
+    def __init__(
+        self,
+        yaml_metadata: List[TableMetadata],
+        txt_descriptions: List[TableDescription],
+        keyword_index: Optional[Dict[str, Set[str]]] = None
+    ):
         self.yaml_metadata = yaml_metadata
         self.txt_descriptions = txt_descriptions
-        self._build_index()
+        self._build_index(keyword_index)
+        self._build_trigram_index()
 
-    def _build_index(self):
+    def _build_index(self, keyword_index: Optional[Dict[str, Set[str]]] = None):
         """Build search indexes for efficient querying."""
         # Create lookup dictionaries
         self.yaml_by_file = {m.source_file: m for m in self.yaml_metadata}
         self.txt_by_file = {d.source_file: d for d in self.txt_descriptions}
 
+        # TXT description paired with each source file (a .yaml file's .txt twin)
+        self.pair_txt: Dict[str, Optional[TableDescription]] = {
+            source_file: self.txt_by_file.get(source_file.replace('.yaml', '.txt'))
+            for source_file in (*self.yaml_by_file, *self.txt_by_file)
+        }
+
+        # Prompt context for each table, rendered once instead of per SQL request
+        self.context_snippets: Dict[str, str] = {
+            source_file: render_table_context(self.yaml_by_file.get(source_file), txt_desc)
+            for source_file, txt_desc in self.pair_txt.items()
+        }
+
+        # Lowercased column names and titles for search_by_column
+        self._column_lower = [
+            (metadata, column, column.name.lower(), column.title.lower())
+            for metadata in self.yaml_metadata
+            for column in metadata.columns
+        ]
+
+        # Reuse a previously saved keyword index if one was given
+        if keyword_index is not None:
+            self.keyword_index = keyword_index
+            return
+
         # Build inverted index for keywords
-        self.keyword_index: Dict[str, Set[str]] = {}  # keyword -> set of source files
+        self.keyword_index: Dict[str, Set[str]] = defaultdict(set)  # keyword -> set of source files
 
         # Index YAML metadata
         for metadata in self.yaml_metadata:
@@ -43,19 +83,80 @@ class SearchEngine:
             for feature in desc.key_features + desc.joinable_features:
                 self._index_text(feature, desc.source_file)
 
+        # Plain dict from here on, so lookups of unknown keywords can't insert them
+        self.keyword_index = dict(self.keyword_index)
+
+    def _build_trigram_index(self):
+        """Index every keyword by its character trigrams, for partial matching."""
+        self.keyword_order: Dict[str, int] = {}  # keyword -> position in keyword_index
+        self.trigram_index: Dict[str, Set[str]] = {}  # trigram -> set of keywords
+
+        for position, keyword in enumerate(self.keyword_index):
+            self.keyword_order[keyword] = position
+            for i in range(len(keyword) - 2):
+                self.trigram_index.setdefault(keyword[i:i + 3], set()).add(keyword)
+
+    def _partial_matches(self, keyword: str) -> List[str]:
+        """Indexed keywords containing, or contained in, keyword (in index order)."""
+        # A keyword containing this one must have all of its trigrams
+        postings = sorted(
+            (self.trigram_index.get(keyword[i:i + 3], set()) for i in range(len(keyword) - 2)),
+            key=len
+        )
+        candidates = postings[0].intersection(*postings[1:]) if postings else set()
+        matches = {candidate for candidate in candidates if keyword in candidate}
+
+        # A keyword contained in this one is one of its substrings (indexed keywords have 3+ chars)
+        for start in range(len(keyword) - 2):
+            for end in range(start + 3, len(keyword) + 1):
+                if keyword[start:end] in self.keyword_index:
+                    matches.add(keyword[start:end])
+
+        return sorted(matches, key=self.keyword_order.__getitem__)
+
+    def save(self, path, fingerprint):
+        """Persist the keyword index, tagged with the fingerprint of its source files."""
+        payload = {
+            'version': INDEX_FORMAT_VERSION,
+            'fingerprint': fingerprint,
+            # Frozen sets pickle smaller and load faster; the index is read-only once built
+            'keyword_index': {keyword: frozenset(files) for keyword, files in self.keyword_index.items()},
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(
+        cls,
+        path,
+        fingerprint,
+        yaml_metadata: List[TableMetadata],
+        txt_descriptions: List[TableDescription]
+    ) -> Optional["SearchEngine"]:
+        """Build an engine from a saved index, or return None if it is missing or stale."""
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if payload.get('version') != INDEX_FORMAT_VERSION or payload.get('fingerprint') != fingerprint:
+            return None
+
+        return cls(yaml_metadata, txt_descriptions, keyword_index=payload['keyword_index'])
+
     def _index_text(self, text: str, source_file: str):
         """Add text to the keyword index."""
-        if not text:
+        # Text shorter than 3 characters can't contain an indexable keyword
+        if not text or len(text) < 3:
             return
 
         # Extract keywords (alphanumeric sequences)
-        keywords = re.findall(r'\b\w+\b', text.lower())
+        keywords = _WORD_RE.findall(text.lower())
 
         for keyword in keywords:
             if len(keyword) > 2:  # Ignore very short words
-                if keyword not in self.keyword_index:
-                    self.keyword_index[keyword] = set()
-                self.keyword_index[keyword].add(source_file)
+                self.keyword_index[sys.intern(keyword)].add(source_file)
 
     def search(self, query: str, source_type: str = None, max_results: int = 10) -> List[SearchResult]:
         """
@@ -69,40 +170,73 @@ class SearchEngine:
         Returns:
             List of SearchResult objects ranked by relevance
         """
-        query_keywords = re.findall(r'\b\w+\b', query.lower())
+        return self._search(query, source_type, max_results, self._keyword_evidence)
+
+    def search_batch(self, queries: List[str], source_type: str = None, max_results: int = 10) -> List[List[SearchResult]]:
+        """
+        Run several searches, looking up each distinct keyword only once.
+
+        Returns:
+            One result list per query, in order, the same as search() would return
+        """
+        evidence_by_keyword: Dict[str, List[Tuple[str, Optional[str], Set[str]]]] = {}
+
+        def keyword_evidence(keyword: str) -> List[Tuple[str, Optional[str], Set[str]]]:
+            if keyword not in evidence_by_keyword:
+                evidence_by_keyword[keyword] = self._keyword_evidence(keyword)
+            return evidence_by_keyword[keyword]
+
+        return [self._search(query, source_type, max_results, keyword_evidence) for query in queries]
+
+    def _keyword_evidence(self, keyword: str) -> List[Tuple[str, Optional[str], Set[str]]]:
+        """Index matches for one query keyword: (keyword, partially matched keyword or None, files)."""
+        evidence = []
+
+        # Exact matches
+        if keyword in self.keyword_index:
+            evidence.append((keyword, None, self.keyword_index[keyword]))
+
+        # Partial matches (contains)
+        for indexed_keyword in self._partial_matches(keyword):
+            evidence.append((keyword, indexed_keyword, self.keyword_index[indexed_keyword]))
+
+        return evidence
 
-        # Find matching files
-        file_scores: Dict[str, float] = {}
-        file_matches: Dict[str, List[str]] = {}
+    def _search(
+        self,
+        query: str,
+        source_type: Optional[str],
+        max_results: int,
+        keyword_evidence: Callable[[str], List[Tuple[str, Optional[str], Set[str]]]]
+    ) -> List[SearchResult]:
+        """Score and rank tables for a query, looking up keywords with keyword_evidence."""
+        query_keywords = _WORD_RE.findall(query.lower())
+
+        # Find matching files, scoring in half points (exact = 2, partial = 1)
+        # so Counter.update can tally each postings set in one C-level call
+        half_points: Counter = Counter()
+
+        # Match evidence in query order: (keyword, partially matched keyword or None, files).
+        # Reason strings are only formatted for the results that are returned.
+        evidence: List[Tuple[str, Optional[str], Set[str]]] = []
 
         for keyword in query_keywords:
             if len(keyword) <= 2:
                 continue
 
-            # Exact matches
-            if keyword in self.keyword_index:
-                for source_file in self.keyword_index[keyword]:
-                    file_scores[source_file] = file_scores.get(source_file, 0) + 1.0
-                    if source_file not in file_matches:
-                        file_matches[source_file] = []
-                    file_matches[source_file].append(f"Matched keyword: '{keyword}'")
-
-            # Partial matches (contains)
-            for indexed_keyword, files in self.keyword_index.items():
-                if keyword in indexed_keyword or indexed_keyword in keyword:
-                    for source_file in files:
-                        file_scores[source_file] = file_scores.get(source_file, 0) + 0.5
-                        if source_file not in file_matches:
-                            file_matches[source_file] = []
-                        if f"Partial match: '{keyword}' in '{indexed_keyword}'" not in file_matches[source_file]:
-                            file_matches[source_file].append(f"Partial match: '{keyword}' ~ '{indexed_keyword}'")
+            for item in keyword_evidence(keyword):
+                files = item[2]
+                half_points.update(files)
+                if item[1] is None:
+                    half_points.update(files)
+                evidence.append(item)
 
         # Build search results
         results = []
 
-        for source_file, score in file_scores.items():
+        for source_file, points in half_points.items():
             yaml_meta = self.yaml_by_file.get(source_file)
-            txt_desc = self.txt_by_file.get(source_file.replace('.yaml', '.txt'))
+            txt_desc = self.pair_txt.get(source_file)
 
             # Apply source type filter
             if source_type:
@@ -111,42 +245,56 @@ class SearchEngine:
                 if txt_desc and not yaml_meta and txt_desc.source_type != source_type:
                     continue
 
-            result = SearchResult(
-                table_metadata=yaml_meta,
-                table_description=txt_desc,
-                relevance_score=score,
-                match_reasons=file_matches.get(source_file, [])
-            )
+            results.append(self.build_result(source_file, points * 0.5))
 
-            results.append(result)
+        # Select the top results by relevance score (same order as a stable descending sort)
+        results = heapq.nlargest(max_results, results, key=lambda r: r.relevance_score)
 
-        # Sort by relevance score
-        results.sort(key=lambda r: r.relevance_score, reverse=True)
+        for result in results:
+            result.match_reasons = self._format_match_reasons(result.get_source_file(), evidence)
+
+        return results
 
-        return results[:max_results]
+    @staticmethod
+    def _format_match_reasons(
+        source_file: str,
+        evidence: List[Tuple[str, Optional[str], Set[str]]]
+    ) -> List[str]:
+        """Describe why source_file matched, from the evidence collected by search."""
+        return [
+            f"Matched keyword: '{keyword}'" if indexed_keyword is None
+            else f"Partial match: '{keyword}' ~ '{indexed_keyword}'"
+            for keyword, indexed_keyword, files in evidence
+            if source_file in files
+        ]
 
     def search_by_column(self, column_name: str, source_type: str = None) -> List[SearchResult]:
         """Search for tables that have a specific column."""
         results = []
+        column_name_lower = column_name.lower()
+        seen = set()  # ids of tables already added, so each is added once
 
-        for metadata in self.yaml_metadata:
+        for metadata, column, name_lower, title_lower in self._column_lower:
             # Apply source type filter
             if source_type and metadata.source_type != source_type:
                 continue
 
-            for column in metadata.columns:
-                if column_name.lower() in column.name.lower() or column_name.lower() in column.title.lower():
-                    txt_desc = self.txt_by_file.get(metadata.source_file.replace('.yaml', '.txt'))
+            if id(metadata) in seen:
+                continue
+
+            if column_name_lower in name_lower or column_name_lower in title_lower:
+                seen.add(id(metadata))
+                txt_desc = self.pair_txt.get(metadata.source_file)
 
-                    result = SearchResult(
-                        table_metadata=metadata,
-                        table_description=txt_desc,
-                        relevance_score=1.0,
-                        match_reasons=[f"Contains column: {column.name}"]
-                    )
+                result = SearchResult(
+                    table_metadata=metadata,
+                    table_description=txt_desc,
+                    relevance_score=1.0,
+                    match_reasons=[f"Contains column: {column.name}"],
+                    context_snippet=self.context_snippets.get(metadata.source_file)
+                )
 
-                    results.append(result)
-                    break  # Only add each table once
+                results.append(result)
 
         return results
 
@@ -158,15 +306,30 @@ class SearchEngine:
             if source_type and metadata.source_type != source_type:
                 continue
 
-            txt_desc = self.txt_by_file.get(metadata.source_file.replace('.yaml', '.txt'))
+            txt_desc = self.pair_txt.get(metadata.source_file)
 
             result = SearchResult(
                 table_metadata=metadata,
                 table_description=txt_desc,
                 relevance_score=0.0,
-                match_reasons=["All tables"]
+                match_reasons=["All tables"],
+                context_snippet=self.context_snippets.get(metadata.source_file)
             )
 
             results.append(result)
 
         return results
+
+    def build_result(self, source_file: str, relevance_score: float = 0.0, match_reasons: List[str] = None) -> SearchResult:
+        """Build a SearchResult for an indexed source file.
+
+        Also used to rehydrate results that were cached as plain
+        (source_file, score, reasons) rows.
+        """
+        return SearchResult(
+            table_metadata=self.yaml_by_file.get(source_file),
+            table_description=self.pair_txt.get(source_file),
+            relevance_score=relevance_score,
+            match_reasons=match_reasons or [],
+            context_snippet=self.context_snippets.get(source_file)
+        )
@@ -1,7 +1,247 @@
 """LLM-powered SQL query generation from metadata."""
+import hashlib
 import json
-from typing import List, Optional, Dict, Any
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any, AsyncIterator, Callable, Tuple
 from models import SearchResult
+from async_runner import run_async
+from llm_throttle import estimate_tokens, throttled_chat_completion
+
+# Optional faster JSON parser; the stdlib decoder is used when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_SQL_SYSTEM_PROMPT = """You are an expert SQL query writer for data warehouses.
+You have access to table metadata including columns, descriptions, and relationships.
+
+Your job is to:
+1. Understand what the user wants to query
+2. Generate correct SQL using the available tables and columns
+3. Use appropriate JOINs based on joinable features
+4. Add helpful WHERE clauses, GROUP BY, ORDER BY as needed
+5. Follow best practices for readable SQL
+
+Respond in JSON format:
+{
+    "sql_query": "SELECT ... FROM ... WHERE ...",
+    "explanation": "This query retrieves...",
+    "tables_used": ["table1", "table2"],
+    "assumptions": ["assuming...", "..."],
+    "alternatives": ["Could also use...", "..."]
+}
+
+Important:
+- Use proper table aliases
+- Include comments in SQL for clarity
+- Consider performance (use appropriate indexes/filters)
+- Handle NULL values appropriately
+- Use ANSI SQL standard syntax
+"""
+
+# System messages are built once and shared by every request; never mutate them
+_SQL_SYSTEM_MESSAGE = {"role": "system", "content": _SQL_SYSTEM_PROMPT}
+
+# Request JSON mode so responses are a bare JSON object, without markdown fences
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Markdown code fences around JSON in LLM responses (a ```json fence is preferred)
+_JSON_FENCE_RE = re.compile(r"```json(.*?)(?:```|$)", re.S)
+_FENCE_RE = re.compile(r"```(.*?)(?:```|$)", re.S)
+_JSON_DECODER = json.JSONDecoder()
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Pieces for reading the sql_query value out of a partially streamed response
+_SQL_QUERY_KEY_RE = re.compile(r'"sql_query"\s*:\s*"')
+_JSON_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_PARTIAL_UNICODE_ESCAPE_RE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+_LENIENT_DECODER = json.JSONDecoder(strict=False)
+
+# On-disk cache of LLM responses (except sampled, temperature > 0 ones), in the project root
+RESPONSE_CACHE_DIR = Path(__file__).resolve().parent.parent / ".sql_cache"
+
+# Cached responses older than this are ignored and deleted
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Oldest cached responses are deleted beyond this many files
+RESPONSE_CACHE_MAX_FILES = 1000
+
+# Approximate token budget for conversation history in generate_sql prompts
+HISTORY_TOKEN_BUDGET = 3072
+
+# History windows start on multiples of this many messages, so the prompt
+# prefix stays byte-identical for several turns instead of shifting each time
+HISTORY_CHUNK_MESSAGES = 4
+
+# Maximum number of tables-context strings memoized per generator
+TABLES_CONTEXT_CACHE_SIZE = 128
+
+_REFINE_SYSTEM_PROMPT = """You are an expert SQL query writer.
+Refine the given SQL query based on the user's request.
+
+Respond in JSON format:
+{
+    "sql_query": "refined SQL",
+    "explanation": "what changed and why",
+    "changes": ["change 1", "change 2"]
+}
+"""
+
+_REFINE_SYSTEM_MESSAGE = {"role": "system", "content": _REFINE_SYSTEM_PROMPT}
+
+_EXPLAIN_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """You are an expert at explaining SQL queries in plain English.
+Explain what the query does in a way that non-technical users can understand."""
+}
+
+
+def _strip_sql(sql: str) -> Optional[str]:
+    """Drop a trailing semicolon, or return None for SQL that isn't a single statement."""
+    sql = sql.rstrip().rstrip(';').rstrip()
+    return None if ';' in sql else sql
+
+
+# SQL string literals and comments
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_LINE_COMMENT_RE = re.compile(r'--[^\n]*')
+_SQL_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+
+_SELECT_LIST_RE = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\b', re.I | re.S)
+
+
+def _selects_column(sql: str, column: str) -> bool:
+    """Whether column is named in the select list, as a column or alias (not a function)."""
+    # Ignore words inside string literals and comments
+    sql = _SQL_STRING_RE.sub("''", sql)
+    sql = _SQL_BLOCK_COMMENT_RE.sub(' ', _SQL_LINE_COMMENT_RE.sub('', sql))
+    if sql.count("'") % 2:
+        return False  # Unbalanced quotes (e.g. an apostrophe in a comment); let the LLM decide
+
+    select = _SELECT_LIST_RE.match(sql)
+    return select is not None and re.search(
+        rf'(?<!\w){re.escape(column)}(?!\w|\s*\()', select.group(1), re.I
+    ) is not None
+
+
+_TRAILING_LIMIT_RE = re.compile(r'\bLIMIT\s+\d+$', re.I)
+_ROW_LIMIT_RE = re.compile(r'\b(?:LIMIT|OFFSET|FETCH|TOP)\b', re.I)
+_ORDER_OR_LIMIT_RE = re.compile(r'\b(?:ORDER\s+BY|LIMIT|OFFSET|FETCH|TOP)\b', re.I)
+
+
+def _refine_limit(sql: str, match: re.Match) -> Optional[Tuple[str, str]]:
+    """Replace a trailing LIMIT clause, or add one to a query without row limits."""
+    limit = match.group(1)
+    sql = _strip_sql(sql)
+    if sql is None:
+        return None
+    if _TRAILING_LIMIT_RE.search(sql) and len(_ROW_LIMIT_RE.findall(sql)) == 1:
+        return _TRAILING_LIMIT_RE.sub(f"LIMIT {limit}", sql), f"Changed LIMIT to {limit}"
+    if _ROW_LIMIT_RE.search(sql):
+        return None  # Other row-limit syntax; leave it to the LLM
+    return f"{sql}\nLIMIT {limit}", f"Added LIMIT {limit}"
+
+
+def _refine_order_by(sql: str, match: re.Match) -> Optional[Tuple[str, str]]:
+    """Append an ORDER BY clause to a query without ORDER BY or row limits."""
+    sql = _strip_sql(sql)
+    if sql is None or _ORDER_OR_LIMIT_RE.search(sql):
+        return None  # Clause placement needs real editing; leave it to the LLM
+    column = match.group(1)
+    if not _selects_column(sql, column):
+        return None  # e.g. "count" for COUNT(*); the LLM can map it to an expression
+    direction = " DESC" if (match.group(2) or "").lower().startswith("desc") else ""
+    return f"{sql}\nORDER BY {column}{direction}", f"Added ORDER BY {column}{direction}"
+
+
+# Mechanical refinements applied without an LLM call: (request pattern, handler).
+# Handlers return (refined_sql, change) or None to fall through to the LLM.
+_TRIVIAL_REFINEMENTS = [
+    (
+        re.compile(r'(?:add\s+(?:a\s+)?)?limit(?:\s+(?:it|the\s+results?|results?|rows?))?(?:\s+to)?\s+(\d+)(?:\s+rows?)?', re.I),
+        _refine_limit,
+    ),
+    (
+        re.compile(r'(?:add\s+(?:an?\s+)?)?(?:order|sort)(?:\s+it|\s+results?)?\s+by\s+([A-Za-z_][\w.]*)(?:\s+(asc|desc|ascending|descending))?', re.I),
+        _refine_order_by,
+    ),
+]
+
+
+# Single-table SELECTs simple enough to explain from a template
+_SIMPLE_SELECT_RE = re.compile(
+    r'SELECT\s+(?P<columns>.+?)'
+    r'\s+FROM\s+(?P<table>[\w.]+)(?:\s+(?:AS\s+)?(?!(?:WHERE|ORDER|LIMIT)\b)(?P<alias>\w+))?'
+    r'(?:\s+WHERE\s+(?P<where>.+?))?'
+    r'(?:\s+ORDER\s+BY\s+(?P<order>.+?))?'
+    r'(?:\s+LIMIT\s+(?P<limit>\d+))?',
+    re.I | re.S
+)
+_COMPLEX_SQL_RE = re.compile(
+    r'\b(?:JOIN|UNION|INTERSECT|EXCEPT|GROUP|HAVING|WITH|OVER|DISTINCT|CASE|TOP'
+    r'|OFFSET|FETCH|FOR|ROWS?|NEXT|ONLY|INTO|QUALIFY|WINDOW|LATERAL|APPLY|PIVOT|UNPIVOT|TABLESAMPLE)\b',
+    re.I
+)
+# Clause keywords that must not end up inside a captured WHERE or ORDER BY
+_CLAUSE_KEYWORD_RE = re.compile(r'\b(?:SELECT|FROM|WHERE|ORDER|LIMIT)\b', re.I)
+_MASKED_LITERAL_RE = re.compile(r'\0(\d+)\0')
+
+
+def _explain_simple_select(sql: str) -> Optional[str]:
+    """Explain a single-table SELECT from a template, or return None if it isn't one."""
+    if "'" in sql and ('--' in sql or '/*' in sql):
+        return None  # A comment marker might be inside a string literal
+
+    # Mask string literals, so keywords, commas or parentheses inside them
+    # can't be mistaken for SQL structure
+    literals = []
+
+    def mask(literal: re.Match) -> str:
+        literals.append(literal.group())
+        return f"\0{len(literals) - 1}\0"
+
+    def unmask(text: str) -> str:
+        return _MASKED_LITERAL_RE.sub(lambda m: literals[int(m.group(1))], text)
+
+    sql = _SQL_STRING_RE.sub(mask, sql)
+    sql = _SQL_BLOCK_COMMENT_RE.sub(' ', _SQL_LINE_COMMENT_RE.sub('', sql))
+    sql = _strip_sql(sql)
+    # Unterminated strings, quoted identifiers, subqueries and function calls need the LLM
+    if not sql or "'" in sql or '"' in sql or '(' in sql or _COMPLEX_SQL_RE.search(sql):
+        return None
+
+    match = _SIMPLE_SELECT_RE.fullmatch(' '.join(sql.split()))
+    if match is None or any(
+        _CLAUSE_KEYWORD_RE.search(match.group(clause) or '') for clause in ('where', 'order')
+    ):
+        return None  # e.g. "LIMIT 10, 5" swallowed by a clause the template doesn't model
+
+    def plain(text: str) -> str:
+        # Drop the table alias from qualified column names
+        alias = match.group('alias')
+        return unmask(re.sub(rf'\b{re.escape(alias)}\.', '', text) if alias else text)
+
+    columns = match.group('columns')
+    columns = "all columns" if columns == '*' else ", ".join(plain(c.strip()) for c in columns.split(','))
+
+    explanation = f"Retrieves {columns} from the {match.group('table')} table"
+    if match.group('where'):
+        explanation += f", keeping only rows where {plain(match.group('where'))}"
+    if match.group('order'):
+        explanation += f", sorted by {plain(match.group('order'))}"
+    if match.group('limit'):
+        explanation += f", returning at most {match.group('limit')} rows"
+
+    return explanation + "."
 
 
 class SQLGenerator:
@@ -11,12 +251,122 @@ class SQLGenerator:
         self.client = llm_client
         self.model = model
 
+        # Token usage of the last non-streaming call, for monitoring prompt cache hits
+        self.last_usage: Dict[str, int] = {}
+
+        # Memoized tables contexts (LRU), shared by the sessions using this generator
+        self._context_cache: OrderedDict = OrderedDict()
+        self._context_lock = threading.Lock()
+
+    @throttled_chat_completion
+    async def _chat(self, messages: List[Dict[str, str]], **kwargs):
+        """Send a rate-limited chat completion request."""
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            **kwargs
+        )
+
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            details = getattr(usage, 'prompt_tokens_details', None)
+            self.last_usage = {
+                'prompt_tokens': usage.prompt_tokens,
+                'cached_tokens': getattr(details, 'cached_tokens', None) or 0,
+            }
+
+        return response
+
+    async def _cached_complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        validate: Optional[Callable[[str], Any]] = None,
+        **kwargs
+    ) -> str:
+        """Return the response text for messages, from the disk cache when possible.
+
+        temperature is only sent when given (some models reject anything but
+        their default). Responses are cached unless temperature is above 0,
+        keyed by a hash of the client's endpoint, model, messages and the
+        request options sent. If given, validate must accept the text (not
+        raise) before it is cached.
+        """
+        if temperature is not None:
+            kwargs['temperature'] = temperature
+
+        if temperature is not None and temperature > 0:
+            response = await self._chat(messages, **kwargs)
+            return response.choices[0].message.content
+
+        key = hashlib.sha256(
+            json.dumps(
+                [str(getattr(self.client, 'base_url', '')), self.model, messages, kwargs],
+                sort_keys=True
+            ).encode()
+        ).hexdigest()
+        cache_path = RESPONSE_CACHE_DIR / f"{key}.json"
+
+        try:
+            if time.time() - cache_path.stat().st_mtime < RESPONSE_CACHE_TTL_SECONDS:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)['content']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        response = await self._chat(messages, **kwargs)
+        content = response.choices[0].message.content
+
+        if validate is not None:
+            validate(content)
+
+        try:
+            RESPONSE_CACHE_DIR.mkdir(exist_ok=True)
+            # Write then rename, so concurrent readers never see a partial file
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'model': self.model, 'content': content}, f)
+            os.replace(tmp_path, cache_path)
+            self._prune_response_cache()
+        except OSError:
+            logger.exception("Error saving response cache")
+
+        return content
+
+    @staticmethod
+    def _prune_response_cache():
+        """Delete expired cached responses, then the oldest beyond RESPONSE_CACHE_MAX_FILES."""
+        expires = time.time() - RESPONSE_CACHE_TTL_SECONDS
+        entries = []
+        for path in RESPONSE_CACHE_DIR.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue  # Deleted by a concurrent prune
+
+        entries.sort(reverse=True)
+        for i, (mtime, path) in enumerate(entries):
+            if i >= RESPONSE_CACHE_MAX_FILES or mtime < expires:
+                path.unlink(missing_ok=True)
+
     def generate_sql(
         self,
         user_query: str,
         search_results: List[SearchResult],
         conversation_history: List[Dict[str, str]],
         selected_tables: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Blocking wrapper around generate_sql_async."""
+        return run_async(self.generate_sql_async(
+            user_query, search_results, conversation_history, selected_tables
+        ))
+
+    async def generate_sql_async(
+        self,
+        user_query: str,
+        search_results: List[SearchResult],
+        conversation_history: List[Dict[str, str]],
+        selected_tables: Optional[List[int]] = None
     ) -> Dict[str, Any]:
         """
         Generate SQL query based on user intent and available tables.
@@ -35,6 +385,106 @@ class SQLGenerator:
                 - assumptions: Any assumptions made
                 - alternatives: Other ways to write the query
         """
+        messages = self._build_generate_messages(
+            user_query, search_results, conversation_history, selected_tables
+        )
+
+        try:
+            llm_response = await self._cached_complete(
+                messages,
+                validate=self._parse_json_response,
+                response_format=_JSON_RESPONSE_FORMAT
+            )
+
+            # Parse JSON response
+            parsed = self._parse_json_response(llm_response)
+
+            return self._sql_result(parsed)
+
+        except Exception as e:
+            logger.exception("Error generating SQL")
+            return self.error_result(e)
+
+    async def stream_sql(
+        self,
+        user_query: str,
+        search_results: List[SearchResult],
+        conversation_history: List[Dict[str, str]],
+        selected_tables: Optional[List[int]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the raw LLM response for a generate_sql request.
+
+        Yields text chunks as they arrive, so the UI can render from the
+        first token. Pass the concatenated text to parse_sql_response to get
+        the same dict generate_sql returns. API errors propagate to the caller.
+        """
+        messages = self._build_generate_messages(
+            user_query, search_results, conversation_history, selected_tables
+        )
+
+        stream = await self._chat(messages, stream=True, response_format=_JSON_RESPONSE_FORMAT)
+
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @staticmethod
+    def partial_sql_query(partial_response: str) -> Optional[str]:
+        """Return the sql_query value streamed so far, or None if it hasn't started.
+
+        Works on an incomplete response, so the UI can show the query while
+        the rest of the JSON (explanation, assumptions, ...) is still arriving.
+        """
+        key = _SQL_QUERY_KEY_RE.search(partial_response)
+        if key is None:
+            return None
+
+        # String body up to the closing quote, or everything received so far
+        body = _JSON_STRING_BODY_RE.match(partial_response, key.end()).group()
+        body = _PARTIAL_UNICODE_ESCAPE_RE.sub('', body)
+
+        try:
+            return _LENIENT_DECODER.decode(f'"{body}"')
+        except ValueError:
+            return None
+
+    def parse_sql_response(self, llm_response: str) -> Dict[str, Any]:
+        """Turn a complete generate_sql LLM response into a result dict."""
+        try:
+            return self._sql_result(self._parse_json_response(llm_response))
+        except Exception as e:
+            logger.exception("Error generating SQL")
+            return self.error_result(e)
+
+    def _build_generate_messages(
+        self,
+        user_query: str,
+        search_results: List[SearchResult],
+        conversation_history: List[Dict[str, str]],
+        selected_tables: Optional[List[int]] = None
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a generate_sql request."""
+        messages = self._generate_prefix(search_results, selected_tables)
+
+        # Add conversation history for context
+        messages.extend(self._history_window(conversation_history))
+
+        # Create prompt for SQL generation
+        user_prompt = f"""User wants to: "{user_query}"
+
+Generate an appropriate SQL query that answers the user's need using the tables above."""
+
+        messages.append({"role": "user", "content": user_prompt})
+
+        return messages
+
+    def _generate_prefix(
+        self,
+        search_results: List[SearchResult],
+        selected_tables: Optional[List[int]] = None
+    ) -> List[Dict[str, str]]:
+        """Build the stable leading messages (system prompt, then tables) of a generate_sql request."""
         # Use top results if no selection
         if selected_tables is None:
             selected_tables = list(range(min(3, len(search_results))))
@@ -42,95 +492,183 @@ class SQLGenerator:
         # Build context from selected tables
         tables_context = self._build_tables_context(search_results, selected_tables)
 
-        # Create prompt for SQL generation
-        system_prompt = """You are an expert SQL query writer for data warehouses.
-You have access to table metadata including columns, descriptions, and relationships.
-
-Your job is to:
-1. Understand what the user wants to query
-2. Generate correct SQL using the available tables and columns
-3. Use appropriate JOINs based on joinable features
-4. Add helpful WHERE clauses, GROUP BY, ORDER BY as needed
-5. Follow best practices for readable SQL
-
-Respond in JSON format:
-{
-    "sql_query": "SELECT ... FROM ... WHERE ...",
-    "explanation": "This query retrieves...",
-    "tables_used": ["table1", "table2"],
-    "assumptions": ["assuming...", "..."],
-    "alternatives": ["Could also use...", "..."]
-}
+        # Stable parts go first, so repeat requests share a prefix the provider can cache
+        return [
+            _SQL_SYSTEM_MESSAGE,
+            {"role": "user", "content": f"Available tables and columns:\n{tables_context}"},
+        ]
 
-Important:
-- Use proper table aliases
-- Include comments in SQL for clarity
-- Consider performance (use appropriate indexes/filters)
-- Handle NULL values appropriately
-- Use ANSI SQL standard syntax
-"""
+    @staticmethod
+    def _history_window(conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Select the recent history that fits HISTORY_TOKEN_BUDGET.
 
-        user_prompt = f"""User wants to: "{user_query}"
+        The window start is rounded up to a HISTORY_CHUNK_MESSAGES boundary
+        when that still keeps a full chunk (or everything that fits), so
+        consecutive requests usually share the same leading history messages.
+        The window never starts with an assistant reply cut off from its question.
+        """
+        # Earliest start whose messages fit the budget
+        start = len(conversation_history)
+        tokens = 0
+        while start > 0:
+            tokens += estimate_tokens([conversation_history[start - 1]])
+            if tokens > HISTORY_TOKEN_BUDGET:
+                break
+            start -= 1
+
+        fitted = len(conversation_history) - start
+        aligned = -(-start // HISTORY_CHUNK_MESSAGES) * HISTORY_CHUNK_MESSAGES
+        if len(conversation_history) - aligned >= min(HISTORY_CHUNK_MESSAGES, fitted):
+            start = aligned
+
+        # Keep user/assistant pairs together
+        while start < len(conversation_history) and conversation_history[start].get('role') == 'assistant':
+            start += 1
+
+        return list(conversation_history[start:])
+
+    def generate_sql_batch(
+        self,
+        user_queries: List[str],
+        search_results: List[SearchResult],
+        selected_tables: Optional[List[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Blocking wrapper around generate_sql_batch_async."""
+        return run_async(self.generate_sql_batch_async(user_queries, search_results, selected_tables))
 
-Available tables and columns:
-{tables_context}
+    async def generate_sql_batch_async(
+        self,
+        user_queries: List[str],
+        search_results: List[SearchResult],
+        selected_tables: Optional[List[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate SQL for several requests over the same tables in one LLM call.
 
-Generate an appropriate SQL query that answers the user's need."""
+        Uses one request (and one RPM slot) instead of one per query, which
+        helps when the requests-per-minute limit is the binding constraint.
 
-        # Call LLM
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
+        Returns:
+            One result dict per query, in order, shaped like generate_sql's
+        """
+        if selected_tables is None:
+            selected_tables = list(range(min(3, len(search_results))))
 
-        # Add conversation history for context
-        for msg in conversation_history[-4:]:  # Last 2 exchanges
-            messages.append(msg)
+        tables_context = self._build_tables_context(search_results, selected_tables)
 
-        messages.append({"role": "user", "content": user_prompt})
+        requests_text = "\n\n".join(
+            f"### Request {i}\nUser wants to: \"{query}\""
+            for i, query in enumerate(user_queries, 1)
+        )
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
+        user_prompt = f"""Available tables and columns:
+{tables_context}
 
-            llm_response = response.choices[0].message.content
+Generate an appropriate SQL query for each of the following requests.
 
-            # Parse JSON response
-            json_match = llm_response
-            if "```json" in llm_response:
-                json_match = llm_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in llm_response:
-                json_match = llm_response.split("```")[1].split("```")[0].strip()
+{requests_text}
 
-            parsed = json.loads(json_match)
+Respond with a single JSON object of the form
+{{"results": [{{"request": 1, ...}}, {{"request": 2, ...}}]}}
+where each entry uses the JSON format described above plus the request number."""
 
-            return {
-                'sql_query': parsed.get('sql_query', ''),
-                'explanation': parsed.get('explanation', ''),
-                'tables_used': parsed.get('tables_used', []),
-                'assumptions': parsed.get('assumptions', []),
-                'alternatives': parsed.get('alternatives', []),
-                'success': True
+        try:
+            response = await self._chat([
+                _SQL_SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt}
+            ], response_format=_JSON_RESPONSE_FORMAT)
+
+            parsed = self._parse_json_response(response.choices[0].message.content)
+
+            # Demultiplex by request number
+            by_request = {
+                item.get('request'): item
+                for item in parsed.get('results', [])
+                if isinstance(item, dict)
             }
 
+            return [
+                self._sql_result(by_request[i]) if i in by_request
+                else self.error_result(ValueError(f"No result returned for request {i}"))
+                for i in range(1, len(user_queries) + 1)
+            ]
+
         except Exception as e:
-            print(f"Error generating SQL: {e}")
-            return {
-                'sql_query': '-- Error generating SQL',
-                'explanation': f'Error: {str(e)}',
-                'tables_used': [],
-                'assumptions': [],
-                'alternatives': [],
-                'success': False,
-                'error': str(e)
-            }
+            logger.exception("Error generating SQL batch")
+            return [self.error_result(e) for _ in user_queries]
+
+    @staticmethod
+    def _parse_json_response(llm_response: str) -> Dict[str, Any]:
+        """Parse a JSON object from an LLM response, handling markdown code blocks."""
+        # JSON mode: the whole response is the object (string values may contain fences)
+        try:
+            parsed = _json_loads(llm_response)
+        except ValueError:
+            pass
+        else:
+            if isinstance(parsed, dict):
+                return parsed
+
+        # Providers ignoring JSON mode may fence the object or add text around it
+        payloads = [llm_response]
+        if '```' in llm_response:
+            fence = _JSON_FENCE_RE.search(llm_response) or _FENCE_RE.search(llm_response)
+            if fence:
+                payloads.insert(0, fence.group(1))
+
+        for payload in payloads:
+            # Decode from the first brace, ignoring any text around the object
+            start = payload.find('{')
+            if start < 0:
+                continue
+            try:
+                parsed, _ = _JSON_DECODER.raw_decode(payload, start)
+            except ValueError:
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+
+        raise ValueError("No JSON object found in LLM response")
+
+    @staticmethod
+    def _sql_result(parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a successful generate_sql result from parsed LLM output."""
+        return {
+            'sql_query': parsed.get('sql_query', ''),
+            'explanation': parsed.get('explanation', ''),
+            'tables_used': parsed.get('tables_used', []),
+            'assumptions': parsed.get('assumptions', []),
+            'alternatives': parsed.get('alternatives', []),
+            'success': True
+        }
+
+    @staticmethod
+    def error_result(e: Exception) -> Dict[str, Any]:
+        """Build a failed generate_sql result."""
+        return {
+            'sql_query': '-- Error generating SQL',
+            'explanation': f'Error: {str(e)}',
+            'tables_used': [],
+            'assumptions': [],
+            'alternatives': [],
+            'success': False,
+            'error': str(e)
+        }
 
     def refine_sql(
         self,
         original_sql: str,
         refinement_request: str,
         tables_context: str
+    ) -> Dict[str, Any]:
+        """Blocking wrapper around refine_sql_async."""
+        return run_async(self.refine_sql_async(original_sql, refinement_request, tables_context))
+
+    async def refine_sql_async(
+        self,
+        original_sql: str,
+        refinement_request: str,
+        tables_context: str
     ) -> Dict[str, Any]:
         """
         Refine an existing SQL query based on user feedback.
@@ -143,48 +681,32 @@ Generate an appropriate SQL query that answers the user's need."""
         Returns:
             Dict with refined SQL and explanation
         """
-        system_prompt = """You are an expert SQL query writer.
-Refine the given SQL query based on the user's request.
+        # Apply mechanical edits (e.g. "add limit 10") directly
+        trivial = self._trivial_refinement(original_sql, refinement_request)
+        if trivial is not None:
+            return trivial
 
-Respond in JSON format:
-{
-    "sql_query": "refined SQL",
-    "explanation": "what changed and why",
-    "changes": ["change 1", "change 2"]
-}
-"""
+        # Tables go before the SQL so repeated refinements share a cacheable prefix
+        user_prompt = f"""Available tables:
+{tables_context}
 
-        user_prompt = f"""Original SQL:
+Original SQL:
 ```sql
 {original_sql}
 ```
 
-Available tables:
-{tables_context}
-
 User requests: {refinement_request}
 
 Refine the SQL query accordingly."""
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-
-            llm_response = response.choices[0].message.content
+            llm_response = await self._cached_complete([
+                _REFINE_SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt}
+            ], validate=self._parse_json_response, response_format=_JSON_RESPONSE_FORMAT)
 
             # Parse JSON
-            json_match = llm_response
-            if "```json" in llm_response:
-                json_match = llm_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in llm_response:
-                json_match = llm_response.split("```")[1].split("```")[0].strip()
-
-            parsed = json.loads(json_match)
+            parsed = self._parse_json_response(llm_response)
 
             return {
                 'sql_query': parsed.get('sql_query', original_sql),
@@ -194,6 +716,7 @@ Refine the SQL query accordingly."""
             }
 
         except Exception as e:
+            logger.exception("Error refining SQL")
             return {
                 'sql_query': original_sql,
                 'explanation': f'Error: {str(e)}',
@@ -202,56 +725,93 @@ Refine the SQL query accordingly."""
                 'error': str(e)
             }
 
-    def _build_tables_context(
-        self,
-        search_results: List[SearchResult],
-        selected_indices: List[int]
-    ) -> str:
-        """Build a context string describing available tables and columns."""
-        context_parts = []
+    @staticmethod
+    def _trivial_refinement(original_sql: str, refinement_request: str) -> Optional[Dict[str, Any]]:
+        """Refine the SQL without the LLM if the request is a simple mechanical edit."""
+        request = refinement_request.strip().rstrip('.!')
 
-        for idx in selected_indices:
-            if idx >= len(search_results):
+        for pattern, handler in _TRIVIAL_REFINEMENTS:
+            match = pattern.fullmatch(request)
+            if match is None:
                 continue
 
-            result = search_results[idx]
-
-            # Build table context
-            if result.table_metadata:
-                meta = result.table_metadata
-                table_info = [
-                    f"\nTable: {meta.table_loc}",
-                    f"Description: {meta.table_description}",
-                    "\nColumns:"
-                ]
+            refined = handler(original_sql, match)
+            if refined is None:
+                return None
 
-                for col in meta.columns[:20]:  # Limit to 20 columns
-                    col_desc = f"  - {col.name} ({col.datatype})"
-                    if col.description:
-                        col_desc += f": {col.description}"
-                    table_info.append(col_desc)
-
-                if len(meta.columns) > 20:
-                    table_info.append(f"  ... and {len(meta.columns) - 20} more columns")
+            sql_query, change = refined
+            return {
+                'sql_query': sql_query,
+                'explanation': change,
+                'changes': [change],
+                'success': True
+            }
 
-                context_parts.append("\n".join(table_info))
+        return None
 
-            # Add description info if available
-            if result.table_description:
-                desc = result.table_description
-                context_parts.append(f"\nPurpose: {desc.purpose}")
+    def _build_tables_context(
+        self,
+        search_results: List[SearchResult],
+        selected_indices: List[int]
+    ) -> str:
+        """Build a context string describing available tables and columns.
 
-                if desc.joinable_features:
-                    context_parts.append(
-                        f"Joinable on: {', '.join(desc.joinable_features[:5])}"
-                    )
+        Memoized per set of tables, so repeat requests skip the formatting and
+        send byte-identical context (which keeps provider prompt caches warm).
+        """
+        key, tables = self._context_key(search_results, selected_indices)
+
+        with self._context_lock:
+            cached = self._context_cache.get(key)
+            if cached is not None:
+                self._context_cache.move_to_end(key)
+                return cached[1]
+
+        context = self._render_tables_context(search_results, selected_indices)
+
+        with self._context_lock:
+            # Keep the tables referenced so their ids can't be reused while cached
+            self._context_cache[key] = (tables, context)
+            if len(self._context_cache) > TABLES_CONTEXT_CACHE_SIZE:
+                self._context_cache.popitem(last=False)
+
+        return context
+
+    @staticmethod
+    def _context_key(search_results: List[SearchResult], selected_indices: List[int]) -> Tuple[tuple, tuple]:
+        """Return (key, tables) identifying the selected tables by their metadata objects."""
+        tables = tuple(
+            (search_results[idx].table_metadata, search_results[idx].table_description)
+            for idx in selected_indices
+            if idx < len(search_results)
+        )
+        return tuple((id(meta), id(desc)) for meta, desc in tables), tables
+
+    def _render_tables_context(
+        self,
+        search_results: List[SearchResult],
+        selected_indices: List[int]
+    ) -> str:
+        """Join the selected tables' context snippets for a prompt."""
+        snippets = (
+            search_results[idx].get_context_snippet()
+            for idx in selected_indices
+            if idx < len(search_results)
+        )
 
-        return "\n\n".join(context_parts)
+        # Parts are separated by a blank line; results with no table info add nothing
+        return "\n\n".join(filter(None, snippets))
 
     def explain_sql(self, sql_query: str) -> str:
+        """Blocking wrapper around explain_sql_async."""
+        return run_async(self.explain_sql_async(sql_query))
+
+    async def explain_sql_async(self, sql_query: str) -> str:
         """Generate a plain English explanation of a SQL query."""
-        system_prompt = """You are an expert at explaining SQL queries in plain English.
-Explain what the query does in a way that non-technical users can understand."""
+        # Simple single-table queries are explained locally, without an LLM call
+        local = _explain_simple_select(sql_query)
+        if local is not None:
+            return local
 
         user_prompt = f"""Explain this SQL query:
 
@@ -262,15 +822,11 @@ Explain what the query does in a way that non-technical users can understand."""
 Provide a clear, concise explanation."""
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-
-            return response.choices[0].message.content
+            return await self._cached_complete([
+                _EXPLAIN_SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt}
+            ])
 
         except Exception as e:
+            logger.exception("Error explaining SQL")
             return f"Error explaining SQL: {str(e)}"
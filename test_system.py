@@ -6,13 +6,14 @@ from pathlib import Path
 src_path = Path(__file__).parent / "src"
 sys.path.insert(0, str(src_path))
 
-from metadata_loader import MetadataLoader
-from search_engine import SearchEngine
 
 def test_metadata_loading():
     """Test loading metadata from data directory."""
     print("Testing metadata loading...")
 
+    # Imported here so merely importing this script stays fast
+    from metadata_loader import MetadataLoader
+
     loader = MetadataLoader("data")
     yaml_metadata, txt_descriptions = loader.load_all_metadata()
 
@@ -29,12 +30,10 @@ def test_metadata_loading():
     return yaml_metadata, txt_descriptions
 
 
-def test_search_engine(yaml_metadata, txt_descriptions):
+def test_search_engine(search_engine):
     """Test search engine functionality."""
     print("\nTesting search engine...")
 
-    search_engine = SearchEngine(yaml_metadata, txt_descriptions)
-
     # Test search
     test_queries = [
         "borrower",
@@ -43,8 +42,9 @@ def test_search_engine(yaml_metadata, txt_descriptions):
         "loan application"
     ]
 
-    for query in test_queries:
-        results = search_engine.search(query, max_results=3)
+    all_results = search_engine.search_batch(test_queries, max_results=3)
+
+    for query, results in zip(test_queries, all_results):
         print(f"[OK] Query '{query}': found {len(results)} results")
 
         if results:
@@ -52,12 +52,10 @@ def test_search_engine(yaml_metadata, txt_descriptions):
             print(f"  Top result: {top_result.get_table_title()} (score: {top_result.relevance_score:.1f})")
 
 
-def test_column_search(yaml_metadata, txt_descriptions):
+def test_column_search(search_engine):
     """Test column-based search."""
     print("\nTesting column search...")
 
-    search_engine = SearchEngine(yaml_metadata, txt_descriptions)
-
     # Search for tables with SSN column
     results = search_engine.search_by_column("SSN")
     print(f"[OK] Found {len(results)} tables with 'SSN' column")
@@ -80,11 +78,15 @@ def main():
             print("\n[WARNING] No metadata files found. Add YAML files to data/avs/ and data/dlvs/")
             return
 
+        # Build the index once for the search tests
+        from search_engine import SearchEngine
+        search_engine = SearchEngine(yaml_metadata, txt_descriptions)
+
         # Test 2: Search engine
-        test_search_engine(yaml_metadata, txt_descriptions)
+        test_search_engine(search_engine)
 
         # Test 3: Column search
-        test_column_search(yaml_metadata, txt_descriptions)
+        test_column_search(search_engine)
 
         print("\n" + "=" * 60)
         print("[SUCCESS] All tests passed!")